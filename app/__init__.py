@@ -3,12 +3,62 @@
 import os
 import secrets
 import logging
+import threading
+import time
 
 from flask import Flask
 from flask_wtf.csrf import CSRFProtect
 
 csrf = CSRFProtect()
 
+# Sent on every response; HSTS is added in production by create_app()
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+    'Permissions-Policy': 'camera=(), microphone=(), geolocation=()',
+    'Content-Security-Policy': (
+        "default-src 'self'; "
+        "script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://code.iconify.design; "
+        "style-src 'self' 'unsafe-inline' https://api.fontshare.com; "
+        "font-src https://api.fontshare.com https://cdn.fontshare.com; "
+        "img-src 'self' data:; "
+        "connect-src 'self' https://api.iconify.design; "
+        "frame-ancestors 'none'"
+    ),
+}
+
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # seconds
+
+# PID that owns the maintenance thread. Threads don't survive fork(), so a
+# preloaded app starts it in each worker on that worker's first request.
+_maintenance_pid = None
+_maintenance_lock = threading.Lock()
+
+
+def _run_maintenance():
+    """Background loop: prune old usage and optimize the database at startup, then once a day."""
+    from app.db import optimize_db
+    from app.rate_limit import prune_old_usage
+    while True:
+        try:
+            prune_old_usage()
+            optimize_db()
+        except Exception:
+            logging.exception("Database maintenance failed")  # non-critical
+        time.sleep(MAINTENANCE_INTERVAL)
+
+
+def _start_maintenance():
+    """Start this process's maintenance thread if it isn't running yet."""
+    global _maintenance_pid
+    if _maintenance_pid == os.getpid():
+        return
+    with _maintenance_lock:
+        if _maintenance_pid != os.getpid():
+            threading.Thread(target=_run_maintenance, name='db-maintenance', daemon=True).start()
+            _maintenance_pid = os.getpid()
+
 
 def create_app():
     app = Flask(__name__)
@@ -33,36 +83,28 @@ def create_app():
     csrf.init_app(app)
 
     # Initialize database
-    from app.db import init_db
+    from app.db import init_db, rollback_open_transaction
     with app.app_context():
         init_db()
 
-    # Prune old usage on startup
-    from app.rate_limit import prune_old_usage
-    with app.app_context():
-        try:
-            prune_old_usage()
-        except Exception:
-            pass  # non-critical on startup
+    # Connections are per-thread and long-lived: never close, just make
+    # sure a failed request doesn't leave a transaction open.
+    @app.teardown_appcontext
+    def release_db(exc):
+        rollback_open_transaction()
+
+    # Database upkeep runs in the background so worker boot isn't blocked on
+    # it, started lazily so it runs in the serving process, not one that forks
+    app.before_request(_start_maintenance)
 
     # Security headers
+    security_headers = dict(SECURITY_HEADERS)
+    if os.environ.get('FLASK_ENV') == 'production':
+        security_headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+
     @app.after_request
     def set_security_headers(response):
-        response.headers['X-Content-Type-Options'] = 'nosniff'
-        response.headers['X-Frame-Options'] = 'DENY'
-        response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-        response.headers['Permissions-Policy'] = 'camera=(), microphone=(), geolocation=()'
-        response.headers['Content-Security-Policy'] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://code.iconify.design; "
-            "style-src 'self' 'unsafe-inline' https://api.fontshare.com; "
-            "font-src https://api.fontshare.com https://cdn.fontshare.com; "
-            "img-src 'self' data:; "
-            "connect-src 'self' https://api.iconify.design; "
-            "frame-ancestors 'none'"
-        )
-        if os.environ.get('FLASK_ENV') == 'production':
-            response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+        response.headers.update(security_headers)
         return response
 
     # Register routes
@@ -1,67 +1,115 @@
 """Monthly budget tracking — monthly_budget table is the single source of truth for spend."""
 
 import logging
+import sqlite3
+import threading
+import time
 from datetime import datetime, timezone
 
-from app.db import get_db
-from app.config import get_config
+from app.db import get_db, utc_timestamp, call_after_commit
+from app.config import get_configs
 
 logger = logging.getLogger(__name__)
 
+# In-memory mirror of the current month's monthly_budget row, so check_budget
+# doesn't query on every roast. It's refreshed from the upsert in record_cost
+# (once that transaction commits), on month rollover, and after
+# BUDGET_CACHE_TTL seconds so spend recorded by other worker processes is
+# picked up.
+BUDGET_CACHE_TTL = 30.0
+
+_budget_state = {'month': None, 'spent': 0.0, 'count': 0, 'expires': 0.0}
+_budget_lock = threading.Lock()
+
 
 def get_current_month() -> str:
     """Return current month as 'YYYY-MM'."""
     return datetime.now(timezone.utc).strftime('%Y-%m')
 
 
-def get_month_spend(month: str = None) -> float:
-    """Get total spend for a month. Defaults to current month."""
-    month = month or get_current_month()
-    with get_db() as db:
+def _month_totals(month: str) -> tuple[float, int]:
+    """Read (spent_cents, roast_count) for a month straight from the table."""
+    with get_db(write=False) as db:
         row = db.execute(
-            "SELECT spent_cents FROM monthly_budget WHERE month = ?", (month,)
+            "SELECT spent_cents, roast_count FROM monthly_budget WHERE month = ?", (month,)
         ).fetchone()
-        return row['spent_cents'] if row else 0.0
+    return (row['spent_cents'], row['roast_count']) if row else (0.0, 0)
+
+
+def _current_totals() -> tuple[float, int]:
+    """This month's (spent_cents, roast_count), served from the in-process mirror."""
+    month = get_current_month()
+    with _budget_lock:
+        if _budget_state['month'] != month or time.monotonic() >= _budget_state['expires']:
+            spent, count = _month_totals(month)
+            _budget_state.update(month=month, spent=spent, count=count,
+                                 expires=time.monotonic() + BUDGET_CACHE_TTL)
+        return _budget_state['spent'], _budget_state['count']
+
+
+def clear_budget_cache() -> None:
+    """Force the next read to go back to the monthly_budget table."""
+    with _budget_lock:
+        _budget_state['month'] = None
+
+
+def get_month_spend(month: str = None) -> float:
+    """Get total spend for a month. Defaults to current month."""
+    if month is None or month == get_current_month():
+        return _current_totals()[0]
+    return _month_totals(month)[0]
 
 
 def get_month_roast_count(month: str = None) -> int:
     """Get roast count for a month. Defaults to current month."""
-    month = month or get_current_month()
-    with get_db() as db:
-        row = db.execute(
-            "SELECT roast_count FROM monthly_budget WHERE month = ?", (month,)
-        ).fetchone()
-        return row['roast_count'] if row else 0
+    if month is None or month == get_current_month():
+        return _current_totals()[1]
+    return _month_totals(month)[1]
 
 
 def record_cost(cost_cents: float) -> None:
-    """Atomic upsert — no drift possible."""
+    """Atomic upsert — no drift possible. Joins the caller's transaction if one is open."""
     month = get_current_month()
     with get_db() as db:
-        db.execute("""
+        row = db.execute("""
             INSERT INTO monthly_budget (month, spent_cents, roast_count, updated_at)
-            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+            VALUES (?, ?, 1, ?)
             ON CONFLICT (month) DO UPDATE SET
-                spent_cents = spent_cents + ?,
+                spent_cents = spent_cents + excluded.spent_cents,
                 roast_count = roast_count + 1,
-                updated_at = CURRENT_TIMESTAMP
-        """, (month, cost_cents, cost_cents))
+                updated_at = excluded.updated_at
+            RETURNING spent_cents, roast_count
+        """, (month, cost_cents, utc_timestamp())).fetchone()
+        # The upsert hands back the table's totals, which include other workers'
+        # spend. Mirror them only if the (possibly outer) transaction commits.
+        call_after_commit(lambda: _store_totals(month, row['spent_cents'], row['roast_count']))
+
+
+def _store_totals(month: str, spent: float, count: int) -> None:
+    with _budget_lock:
+        _budget_state.update(month=month, spent=spent, count=count,
+                             expires=time.monotonic() + BUDGET_CACHE_TTL)
 
 
 def check_budget() -> tuple[bool, str]:
     """Can we afford another roast?"""
-    budget_limit = float(get_config('monthly_budget_cents', '2000'))
+    config = get_configs({
+        'monthly_budget_cents': '2000',
+        'cost_per_roast_cents': '1',
+        'budget_warning_threshold': '80',
+    })
+    budget_limit = float(config['monthly_budget_cents'])
     current_spend = get_month_spend()
 
     if current_spend >= budget_limit:
         return False, "The roast machine is cooling down. Check back next month."
 
-    estimated_next = float(get_config('cost_per_roast_cents', '1'))
+    estimated_next = float(config['cost_per_roast_cents'])
     if current_spend + estimated_next > budget_limit:
         return False, "The roast machine is cooling down. Check back next month."
 
     # Warning threshold check (for logging, not user-facing)
-    threshold = float(get_config('budget_warning_threshold', '80'))
+    threshold = float(config['budget_warning_threshold'])
     if budget_limit > 0 and (current_spend / budget_limit * 100) >= threshold:
         logger.warning(
             "Budget warning: %.1f%% used (%.2f / %.2f cents)",
@@ -71,11 +119,10 @@ def check_budget() -> tuple[bool, str]:
     return True, "ok"
 
 
-def get_monthly_history() -> list[dict]:
+def get_monthly_history() -> list[sqlite3.Row]:
     """Get all monthly budget records for admin panel."""
-    with get_db() as db:
-        rows = db.execute(
+    with get_db(write=False) as db:
+        return db.execute(
             "SELECT month, spent_cents, roast_count, updated_at "
             "FROM monthly_budget ORDER BY month DESC"
         ).fetchall()
-        return [dict(row) for row in rows]
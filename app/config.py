@@ -1,15 +1,44 @@
 """App configuration table interface (get/set)."""
 
-from app.db import get_db
+import time
+
+from app.db import get_db, utc_timestamp
+
+# Config only changes via the admin panel, so serve it from memory and
+# re-read the (tiny) table at most this often.
+CONFIG_CACHE_TTL = 30.0
+
+_cache: dict[str, str] = {}
+_cache_expires = 0.0
+
+
+def _load_config() -> dict[str, str]:
+    """Return the cached key -> value snapshot, reloading the whole table when stale."""
+    global _cache, _cache_expires
+    now = time.monotonic()
+    if now >= _cache_expires:
+        with get_db(write=False) as db:
+            rows = db.execute("SELECT key, value FROM app_config").fetchall()
+        _cache = {row['key']: row['value'] for row in rows}
+        _cache_expires = now + CONFIG_CACHE_TTL
+    return _cache
+
+
+def clear_config_cache() -> None:
+    """Force the next lookup to re-read app_config."""
+    global _cache_expires
+    _cache_expires = 0.0
 
 
 def get_config(key: str, default: str = None) -> str | None:
     """Get a config value by key."""
-    with get_db() as db:
-        row = db.execute(
-            "SELECT value FROM app_config WHERE key = ?", (key,)
-        ).fetchone()
-        return row['value'] if row else default
+    return _load_config().get(key, default)
+
+
+def get_configs(defaults: dict[str, str]) -> dict[str, str]:
+    """Get several config values at once. Missing keys fall back to defaults."""
+    config = _load_config()
+    return {key: config.get(key, default) for key, default in defaults.items()}
 
 
 def set_config(key: str, value: str) -> None:
@@ -17,15 +46,16 @@ def set_config(key: str, value: str) -> None:
     with get_db() as db:
         db.execute(
             """UPDATE app_config
-               SET value = ?, updated_at = CURRENT_TIMESTAMP
+               SET value = ?, updated_at = ?
                WHERE key = ?""",
-            (value, key)
+            (value, utc_timestamp(), key)
         )
+    clear_config_cache()
 
 
 def get_all_config() -> list[dict]:
     """Get all config entries for the admin panel."""
-    with get_db() as db:
+    with get_db(write=False) as db:
         rows = db.execute(
             "SELECT key, value, description, updated_at FROM app_config ORDER BY key"
         ).fetchall()
@@ -2,7 +2,10 @@
 
 import sqlite3
 import os
+import threading
 from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
 
 DATABASE_PATH = os.environ.get('DATABASE_URL', 'sqlite:///data/roasts.db').replace('sqlite:///', '')
 
@@ -45,20 +48,59 @@ CREATE TABLE IF NOT EXISTS roast_log (
     code_content TEXT
 );
 
--- Daily rate limit tracking (session + IP counters)
+-- Daily rate limit tracking (session + IP counters). WITHOUT ROWID keeps
+-- count in the primary key B-tree, so the rate-limit sums never leave it.
 CREATE TABLE IF NOT EXISTS daily_usage (
     date TEXT,
     identity TEXT,
     count INTEGER DEFAULT 0,
     PRIMARY KEY (date, identity)
-);
+) WITHOUT ROWID;
 
 -- Indexes
 CREATE INDEX IF NOT EXISTS idx_roast_log_share_id ON roast_log(share_id);
 CREATE INDEX IF NOT EXISTS idx_roast_log_created ON roast_log(created_at);
-CREATE INDEX IF NOT EXISTS idx_daily_usage_date ON daily_usage(date);
+-- Landing page feed: newest public roasts
+CREATE INDEX IF NOT EXISTS idx_roast_log_public_created ON roast_log(created_at DESC)
+    WHERE is_public = 1 AND share_id IS NOT NULL;
+-- daily_usage's primary key already leads with date
+DROP INDEX IF EXISTS idx_daily_usage_date;
 """
 
+# Rebuilds a daily_usage table created before it was WITHOUT ROWID. Run
+# statement by statement inside init_db's transaction (executescript would
+# commit it).
+MIGRATE_DAILY_USAGE = [
+    "ALTER TABLE daily_usage RENAME TO daily_usage_legacy",
+    """CREATE TABLE daily_usage (
+        date TEXT,
+        identity TEXT,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (date, identity)
+    ) WITHOUT ROWID""",
+    """INSERT INTO daily_usage (date, identity, count)
+        SELECT date, identity, count FROM daily_usage_legacy""",
+    "DROP TABLE daily_usage_legacy",
+]
+
+# Applied once to the writer connection when it is opened
+WRITER_PRAGMAS = [
+    # Only take effect while the database file is still empty, so they
+    # must run before journal_mode initializes it
+    "PRAGMA page_size=4096",
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+]
+
+# Applied once to every connection (writer and readers) when it is opened
+CONNECTION_PRAGMAS = [
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+]
+
 DEFAULT_CONFIG = [
     ('monthly_budget_cents', '2000', 'Max monthly spend in cents ($20.00)'),
     ('cost_per_roast_cents', '1', 'Estimated cost per roast (Haiku default)'),
@@ -70,6 +112,7 @@ DEFAULT_CONFIG = [
     ('enable_roasting', 'true', 'Kill switch - disable all roasting'),
     ('default_model', 'claude-haiku-4-5-20251001', 'Default model'),
     ('budget_warning_threshold', '80', 'Alert at this % of monthly budget'),
+    ('max_cents_per_call', '10', 'Refuse roasts estimated to cost more than this'),
 ]
 
 
@@ -82,34 +125,162 @@ def get_db_path():
     return db_path
 
 
-def get_connection():
-    """Get a new database connection with WAL mode and busy timeout."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
+def utc_timestamp() -> str:
+    """Current UTC time in SQLite's CURRENT_TIMESTAMP format, for binding as a parameter."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# One long-lived writer per process, serialized by _writer_lock, plus a
+# read-only connection per thread. Under WAL, readers never block the
+# writer and the writer's page cache stays warm.
+_writer = None
+_writer_lock = threading.RLock()
+_local = threading.local()
+
+# Connections inherited across fork(); kept referenced so they are never
+# finalized (closing one in the child would touch the parent's locks)
+_inherited = []
+
+
+def _reset_after_fork():
+    """Forget the parent's connections in a forked worker (gunicorn --preload).
+
+    SQLite connections must not be used across fork(): the child's POSIX
+    locks aren't the parent's, so each worker opens its own on first use.
+    """
+    global _writer, _writer_lock, _local
+    _inherited.extend(conn for conn in (_writer, getattr(_local, 'reader', None)) if conn is not None)
+    _writer = None
+    _writer_lock = threading.RLock()
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _connect(database: str, pragmas: list[str], uri: bool = False) -> sqlite3.Connection:
+    """Open an autocommit connection; transactions are managed by get_db()."""
+    conn = sqlite3.connect(database, uri=uri, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA busy_timeout = 5000")
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+def _get_writer() -> sqlite3.Connection:
+    """The process-wide writer connection. Caller must hold _writer_lock."""
+    global _writer
+    if _writer is None:
+        _writer = _connect(get_db_path(), WRITER_PRAGMAS + CONNECTION_PRAGMAS)
+    return _writer
+
+
+def _get_reader() -> sqlite3.Connection:
+    """This thread's read-only connection, opened on first use."""
+    conn = getattr(_local, 'reader', None)
+    if conn is None:
+        uri = Path(get_db_path()).as_uri() + '?mode=ro'
+        conn = _connect(uri, CONNECTION_PRAGMAS, uri=True)
+        _local.reader = conn
     return conn
 
 
 @contextmanager
-def get_db():
-    """Context manager for database connections."""
-    conn = get_connection()
+def _write_transaction():
+    with _writer_lock:
+        conn = _get_writer()
+        if conn.in_transaction:
+            # Nested in this thread's own write transaction: join it
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        _local.writing = True
+        _local.after_commit = []
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _local.writing = False
+            callbacks, _local.after_commit = _local.after_commit, []
+        for callback in callbacks:
+            callback()
+
+
+@contextmanager
+def _read_transaction():
+    conn = _get_reader()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
     try:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
     finally:
-        conn.close()
+        conn.rollback()  # nothing to commit on a read-only connection
+
+
+def get_db(write: bool = True):
+    """Context manager wrapping a transaction.
+
+    write=True runs on the shared writer connection (BEGIN IMMEDIATE);
+    write=False runs on this thread's read-only connection. Nested uses
+    join the outer transaction, and reads nested inside a write go to the
+    writer so they see its uncommitted changes.
+    """
+    if write or getattr(_local, 'writing', False):
+        return _write_transaction()
+    return _read_transaction()
+
+
+def call_after_commit(callback) -> None:
+    """Run callback once this thread's write transaction commits; dropped on rollback.
+
+    Outside a write transaction it runs immediately.
+    """
+    if getattr(_local, 'writing', False):
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+
+def checkpoint_wal():
+    """Fold the WAL back into the database file and truncate it."""
+    with _writer_lock:
+        _get_writer().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def rollback_open_transaction():
+    """Roll back a read left open on this thread's connection (request teardown)."""
+    conn = getattr(_local, 'reader', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
 
 
 def init_db():
     """Initialize database schema and seed default config."""
+    # executescript commits any open transaction, so the idempotent DDL runs
+    # on its own first; everything that must be atomic follows in one
+    # BEGIN IMMEDIATE, which also serializes workers booting together.
+    with _writer_lock:
+        _get_writer().executescript(SCHEMA)
+
     with get_db() as db:
-        db.executescript(SCHEMA)
+        table_sql = db.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'daily_usage'"
+        ).fetchone()['sql']
+        if 'WITHOUT ROWID' not in table_sql.upper():
+            for statement in MIGRATE_DAILY_USAGE:
+                db.execute(statement)
+        # Gather planner statistics once per database; optimize_db() keeps them fresh
+        has_stats = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if not has_stats:
+            db.execute("ANALYZE")
         for key, value, description in DEFAULT_CONFIG:
             db.execute(
                 """INSERT INTO app_config (key, value, description)
@@ -117,4 +288,12 @@ def init_db():
                    ON CONFLICT(key) DO NOTHING""",
                 (key, value, description)
             )
-        db.commit()
+
+    from app.config import clear_config_cache
+    clear_config_cache()
+
+
+def optimize_db():
+    """Periodic upkeep: re-analyze tables whose stats have drifted and release free pages."""
+    with _writer_lock:
+        _get_writer().executescript("PRAGMA optimize; PRAGMA incremental_vacuum;")
@@ -1,6 +1,7 @@
 """Regex pattern-based language detection. No heavy dependencies needed."""
 
 import re
+from functools import lru_cache
 
 LANGUAGE_PATTERNS = [
     ('python', [r'\bdef\s+\w+\s*\(', r'\bimport\s+\w+', r':\s*$', r'\bself\b', r'print\s*\(', r'if\s+__name__']),
@@ -22,14 +23,44 @@ LANGUAGE_PATTERNS = [
     ('kotlin', [r'\bfun\s+\w+', r'\bval\s+\w+', r'\bvar\s+\w+', r'\bwhen\s*\(']),
 ]
 
+# Compiled once at import; each pattern still counts at most once per language
+COMPILED_PATTERNS = [
+    (lang, [re.compile(p, re.MULTILINE) for p in patterns])
+    for lang, patterns in LANGUAGE_PATTERNS
+]
 
-def detect_language(code: str) -> str:
-    """Score each language by how many of its patterns match. Highest wins."""
+
+# Signatures (shebangs, imports, package decls) cluster at the top of a
+# file, so only this many leading characters are scanned by default.
+HEAD_SCAN_CHARS = 4096
+
+
+def _score_languages(code: str) -> dict[str, int]:
+    """Count how many of each language's patterns match."""
     scores = {}
-    for lang, patterns in LANGUAGE_PATTERNS:
-        score = sum(1 for p in patterns if re.search(p, code, re.MULTILINE))
+    for lang, patterns in COMPILED_PATTERNS:
+        score = sum(1 for p in patterns if p.search(code))
         if score > 0:
             scores[lang] = score
+    return scores
+
+
+# Re-roasting the same paste (or refreshing after an error) skips re-detection
+@lru_cache(maxsize=256)
+def detect_language(code: str) -> str:
+    """Score each language by how many of its patterns match. Highest wins.
+
+    Only the head of long inputs is scanned; the full text is used as a
+    fallback when nothing matches there.
+    """
+    if len(code) > HEAD_SCAN_CHARS:
+        # Cut on a line boundary so end-of-line anchored patterns stay honest
+        cut = code.rfind('\n', 0, HEAD_SCAN_CHARS)
+        scores = _score_languages(code[:cut if cut > 0 else HEAD_SCAN_CHARS])
+        if not scores:
+            scores = _score_languages(code)
+    else:
+        scores = _score_languages(code)
 
     if not scores:
         return "unknown"
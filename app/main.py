@@ -11,15 +11,24 @@ from flask import (
     flash, jsonify, abort, Response
 )
 
-from app.db import get_db
+from app.db import get_db, utc_timestamp
 from app.config import get_config, set_config, get_all_config
 from app.budget import check_budget, record_cost, get_month_spend, get_month_roast_count, get_monthly_history
 from app.rate_limit import check_rate_limit, record_usage, get_remaining_roasts, get_ip_hash
-from app.roaster import roast_code
-from app.security import validate_input, render_roast_markdown, generate_share_id, get_roast_preview
+from app.security import validate_and_detect, render_roast_markdown, generate_share_id, get_roast_preview
 
 logger = logging.getLogger(__name__)
 
+# Fully parameter-bound so the connection's statement cache keeps it prepared
+INSERT_ROAST_SQL = """
+    INSERT INTO roast_log
+        (created_at, session_id, ip_hash, input_chars, input_lines,
+         input_tokens_actual, output_tokens_actual, cost_cents,
+         model, mode, severity, language_detected, share_id,
+         is_public, roast_score, roast_content, code_content)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 
 def register_routes(app):
     """Register all routes on the Flask app."""
@@ -37,7 +46,7 @@ def register_routes(app):
     def index():
         remaining = get_remaining_roasts()
         # Get recent public roasts for the feed
-        with get_db() as db:
+        with get_db(write=False) as db:
             recent_roasts = db.execute(
                 """SELECT share_id, roast_score, language_detected, mode, created_at,
                           substr(roast_content, 1, 200) as preview
@@ -45,7 +54,6 @@ def register_routes(app):
                    WHERE is_public = 1 AND share_id IS NOT NULL
                    ORDER BY created_at DESC LIMIT 10"""
             ).fetchall()
-            recent_roasts = [dict(r) for r in recent_roasts]
 
         return render_template('index.html',
                                remaining_roasts=remaining,
@@ -70,7 +78,7 @@ def register_routes(app):
             return redirect(url_for('index'))
 
         # Validate input
-        valid, error_msg = validate_input(code)
+        valid, error_msg, language = validate_and_detect(code)
         if not valid:
             flash(error_msg, "error")
             return redirect(url_for('index'))
@@ -87,9 +95,14 @@ def register_routes(app):
             flash(rate_msg, "error")
             return redirect(url_for('index'))
 
-        # Perform the roast
+        # Perform the roast (imported here so workers that never roast skip it)
+        from app.roaster import roast_code, RoastTooExpensive
         try:
-            result = roast_code(code, mode=mode, severity=severity)
+            result = roast_code(code, mode=mode, severity=severity, language=language)
+        except RoastTooExpensive as e:
+            logger.warning("Roast refused: %s", e)
+            flash("That paste is too big for one roast. Trim it down to the worst part and try again.", "error")
+            return redirect(url_for('index'))
         except Exception as e:
             logger.error("Roast failed: %s", e)
             flash("Claude is having a moment. Your code was SO bad it broke the reviewer. (Just kidding — try again in a minute.)", "error")
@@ -97,45 +110,40 @@ def register_routes(app):
 
         # Generate share ID and store result
         share_id = generate_share_id()
-        score = result.get('score')
 
+        # Log, cost and usage commit together: one transaction, one WAL sync.
+        # record_cost/record_usage join this transaction via the nested get_db().
         with get_db() as db:
-            db.execute("""
-                INSERT INTO roast_log
-                    (session_id, ip_hash, input_chars, input_lines,
-                     input_tokens_actual, output_tokens_actual, cost_cents,
-                     model, mode, severity, language_detected, share_id,
-                     is_public, roast_score, roast_content, code_content)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            db.execute(INSERT_ROAST_SQL, (
+                utc_timestamp(),
                 session.get('session_id'),
                 get_ip_hash(),
-                len(code),
-                len(code.split('\n')),
-                result['input_tokens'],
-                result['output_tokens'],
-                result['cost_cents'],
-                result['model'],
+                result.input_chars,
+                result.input_lines,
+                result.input_tokens,
+                result.output_tokens,
+                result.cost_cents,
+                result.model,
                 mode,
                 severity,
-                result['language'],
+                result.language,
                 share_id,
                 1 if is_public else 0,
-                score,
-                result['roast'],
+                result.score,
+                result.roast,
                 code if is_public else None,
             ))
 
-        # Record cost and usage (only for successful roasts)
-        if result['cost_cents'] > 0:
-            record_cost(result['cost_cents'])
-        record_usage()
+            # Record cost and usage (only for successful roasts)
+            if result.cost_cents > 0:
+                record_cost(result.cost_cents)
+            record_usage()
 
         return redirect(url_for('view_roast', share_id=share_id))
 
     @app.route('/roast/<share_id>')
     def view_roast(share_id):
-        with get_db() as db:
+        with get_db(write=False) as db:
             roast = db.execute(
                 "SELECT * FROM roast_log WHERE share_id = ?", (share_id,)
             ).fetchone()
@@ -160,7 +168,7 @@ def register_routes(app):
     def health():
         """For Docker healthcheck and uptime monitoring."""
         try:
-            with get_db() as db:
+            with get_db(write=False) as db:
                 db.execute("SELECT 1")
             budget_ok = check_budget()[0]
             return jsonify({"status": "ok", "roasting_enabled": budget_ok}), 200
@@ -210,14 +218,13 @@ def register_routes(app):
         else:
             projected = 0
 
-        with get_db() as db:
+        with get_db(write=False) as db:
             recent_logs = db.execute(
                 """SELECT id, created_at, input_chars, input_tokens_actual,
                           output_tokens_actual, cost_cents, model, mode,
                           severity, language_detected, roast_score, share_id
                    FROM roast_log ORDER BY created_at DESC LIMIT 50"""
             ).fetchall()
-            recent_logs = [dict(r) for r in recent_logs]
 
         return render_template('admin.html',
                                config=config,
@@ -2,12 +2,28 @@
 
 import hashlib
 import os
-from datetime import date, datetime, timedelta
+import time
+from datetime import date, timedelta
 
-from flask import session, request
+from flask import g, session, request
 
-from app.db import get_db
-from app.config import get_config
+from app.db import get_db, checkpoint_wal
+from app.config import get_config, get_configs
+
+
+# (YYYY-MM-DD, epoch of the following local midnight); refreshed once a day
+_current_day = ('', 0.0)
+
+
+def _today() -> tuple[str, float]:
+    """Today's local date string and the epoch time at which it ends."""
+    global _current_day
+    now = time.time()
+    if now >= _current_day[1]:
+        lt = time.localtime(now)
+        day_end = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        _current_day = (time.strftime('%Y-%m-%d', lt), day_end)
+    return _current_day
 
 
 def get_ip_hash() -> str:
@@ -15,8 +31,12 @@ def get_ip_hash() -> str:
 
     Uses X-Forwarded-For only when TRUSTED_PROXY_COUNT is set (i.e. behind
     a known reverse proxy). Otherwise falls back to remote_addr to prevent
-    IP spoofing via forged headers.
+    IP spoofing via forged headers. Computed once per request and kept on g.
     """
+    ip_hash = g.get('ip_hash')
+    if ip_hash is not None:
+        return ip_hash
+
     trusted_proxies = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
     if trusted_proxies > 0 and request.access_route:
         # access_route is the X-Forwarded-For chain; pick the client IP
@@ -25,73 +45,79 @@ def get_ip_hash() -> str:
         ip = request.access_route[idx]
     else:
         ip = request.remote_addr or '127.0.0.1'
-    return hashlib.sha256(ip.encode()).hexdigest()[:16]
+    g.ip_hash = hashlib.sha256(ip.encode()).hexdigest()[:16]
+    return g.ip_hash
+
+
+def _session_identity() -> str:
+    """Session ID for rate limiting, falling back to the IP hash only when missing."""
+    session_id = session.get('session_id')
+    return session_id if session_id is not None else get_ip_hash()
 
 
 def check_rate_limit() -> tuple[bool, str]:
     """Returns (allowed, reason). Checks session first, then IP ceiling, then global."""
-    today = date.today().isoformat()
-    session_id = session.get('session_id', get_ip_hash())
+    today, day_end = _today()
+    session_id = _session_identity()
     ip_hash = get_ip_hash()
 
-    with get_db() as db:
-        # Check 1: Session-based limit (primary)
-        row = db.execute(
-            "SELECT COALESCE(SUM(count), 0) as total FROM daily_usage WHERE date = ? AND identity = ?",
-            (today, f"session:{session_id}")
-        ).fetchone()
-        session_count = row['total']
-
-        session_limit = int(get_config('daily_roasts_per_session', '10'))
-        if session_count >= session_limit:
-            remaining_hours = 24 - datetime.now().hour
-            return False, f"Easy there, glutton for punishment. You've used all {session_limit} roasts for today. Resets in ~{remaining_hours}h."
+    limits = get_configs({
+        'daily_roasts_per_session': '10',
+        'daily_roasts_per_ip': '30',
+        'daily_roasts_global': '500',
+    })
 
-        # Check 2: IP ceiling (anti-abuse backstop)
+    # All three counters in one pass over today's rows
+    with get_db(write=False) as db:
         row = db.execute(
-            "SELECT COALESCE(SUM(count), 0) as total FROM daily_usage WHERE date = ? AND identity = ?",
-            (today, f"ip:{ip_hash}")
+            """SELECT COALESCE(SUM(CASE WHEN identity = ? THEN count END), 0) AS session_total,
+                      COALESCE(SUM(CASE WHEN identity = ? THEN count END), 0) AS ip_total,
+                      COALESCE(SUM(count), 0) AS global_total
+               FROM daily_usage WHERE date = ?""",
+            (f"session:{session_id}", f"ip:{ip_hash}", today)
         ).fetchone()
-        ip_count = row['total']
 
-        ip_ceiling = int(get_config('daily_roasts_per_ip', '30'))
-        if ip_count >= ip_ceiling:
-            return False, "This network has hit its daily limit. Try again tomorrow."
+    # Check 1: Session-based limit (primary)
+    session_limit = int(limits['daily_roasts_per_session'])
+    if row['session_total'] >= session_limit:
+        remaining_hours = int(-((time.time() - day_end) // 3600))  # hours left, rounded up
+        return False, f"Easy there, glutton for punishment. You've used all {session_limit} roasts for today. Resets in ~{remaining_hours}h."
 
-        # Check 3: Global daily cap
-        row = db.execute(
-            "SELECT COALESCE(SUM(count), 0) as total FROM daily_usage WHERE date = ?",
-            (today,)
-        ).fetchone()
-        global_count = row['total']
+    # Check 2: IP ceiling (anti-abuse backstop)
+    ip_ceiling = int(limits['daily_roasts_per_ip'])
+    if row['ip_total'] >= ip_ceiling:
+        return False, "This network has hit its daily limit. Try again tomorrow."
 
-        global_cap = int(get_config('daily_roasts_global', '500'))
-        if global_count >= global_cap:
-            return False, "The roast machine is at capacity for today. Check back tomorrow."
+    # Check 3: Global daily cap
+    global_cap = int(limits['daily_roasts_global'])
+    if row['global_total'] >= global_cap:
+        return False, "The roast machine is at capacity for today. Check back tomorrow."
 
     return True, "ok"
 
 
 def record_usage() -> None:
-    """Call after a successful roast. Increments both session and IP counters."""
-    today = date.today().isoformat()
-    session_id = session.get('session_id', get_ip_hash())
+    """Call after a successful roast. Increments both session and IP counters.
+
+    Joins the caller's transaction if one is open.
+    """
+    today, _ = _today()
+    session_id = _session_identity()
     ip_hash = get_ip_hash()
 
     with get_db() as db:
-        for identity in [f"session:{session_id}", f"ip:{ip_hash}"]:
-            db.execute("""
-                INSERT INTO daily_usage (date, identity, count) VALUES (?, ?, 1)
-                ON CONFLICT (date, identity) DO UPDATE SET count = count + 1
-            """, (today, identity))
+        db.execute("""
+            INSERT INTO daily_usage (date, identity, count) VALUES (?, ?, 1), (?, ?, 1)
+            ON CONFLICT (date, identity) DO UPDATE SET count = count + 1
+        """, (today, f"session:{session_id}", today, f"ip:{ip_hash}"))
 
 
 def get_remaining_roasts() -> int:
     """Get remaining roasts for the current session."""
-    today = date.today().isoformat()
-    session_id = session.get('session_id', get_ip_hash())
+    today, _ = _today()
+    session_id = _session_identity()
 
-    with get_db() as db:
+    with get_db(write=False) as db:
         row = db.execute(
             "SELECT COALESCE(SUM(count), 0) as total FROM daily_usage WHERE date = ? AND identity = ?",
             (today, f"session:{session_id}")
@@ -103,7 +129,12 @@ def get_remaining_roasts() -> int:
 
 
 def prune_old_usage(days_to_keep: int = 7) -> None:
-    """Delete usage records older than N days."""
+    """Delete usage records older than N days, then checkpoint the WAL.
+
+    Runs from the background maintenance thread; the checkpoint keeps the
+    -wal file of long-running workers from growing without bound.
+    """
     cutoff = (date.today() - timedelta(days=days_to_keep)).isoformat()
     with get_db() as db:
         db.execute("DELETE FROM daily_usage WHERE date < ?", (cutoff,))
+    checkpoint_wal()
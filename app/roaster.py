@@ -2,21 +2,96 @@
 
 import os
 import re
+import math
 import random
+import json
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, NamedTuple
 
 from app.config import get_config
 from app.language_detect import detect_language
 
+if TYPE_CHECKING:
+    import anthropic
+
 logger = logging.getLogger(__name__)
 
+
+class RoastTooExpensive(Exception):
+    """Raised before calling the API when the estimated cost exceeds the per-call cap."""
+
+
+class RoastBatchIncomplete(Exception):
+    """Raised by roast_code_batch when a call fails after others were paid for.
+
+    results holds the snippets finished so far, in order; unassigned_cents is
+    spend already incurred that none of them carries. The cause is chained.
+    """
+
+    def __init__(self, results: list, unassigned_cents: float = 0.0):
+        super().__init__(f"batch stopped after {len(results)} snippets")
+        self.results = results
+        self.unassigned_cents = unassigned_cents
+
+
+class RoastResult(NamedTuple):
+    """What roast_code returns: the review plus its usage and input metadata."""
+    roast: str
+    tokens_used: int
+    input_tokens: int
+    output_tokens: int
+    cost_cents: float
+    model: str
+    language: str
+    score: int | None
+    input_chars: int
+    input_lines: int
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
 # --- Model Pricing (per million tokens) ---
 
 MODEL_PRICING = {
-    'haiku': {'input_per_mtok': 0.80, 'output_per_mtok': 4.00},
-    'sonnet': {'input_per_mtok': 3.00, 'output_per_mtok': 15.00},
+    'haiku': {'input_per_mtok': 0.80, 'cached_input_per_mtok': 0.08,
+              'cache_write_per_mtok': 1.00, 'output_per_mtok': 4.00},
+    'sonnet': {'input_per_mtok': 3.00, 'cached_input_per_mtok': 0.30,
+               'cache_write_per_mtok': 3.75, 'output_per_mtok': 15.00},
 }
 
+# Same rates folded into cents per single token: $/MTok * 100 / 1_000_000
+CENTS_PER_TOKEN = {
+    tier: {
+        'input': rates['input_per_mtok'] * 1e-4,
+        'cached_input': rates['cached_input_per_mtok'] * 1e-4,
+        'cache_write': rates['cache_write_per_mtok'] * 1e-4,
+        'output': rates['output_per_mtok'] * 1e-4,
+    }
+    for tier, rates in MODEL_PRICING.items()
+}
+
+# Models that match no tier are priced as sonnet
+DEFAULT_PRICING_TIER = 'sonnet'
+
+_model_tiers: dict[str, str] = {}
+
+
+def get_pricing_tier(model: str) -> str:
+    """Map a model name to its MODEL_PRICING key, scanning the name once per model."""
+    tier = _model_tiers.get(model)
+    if tier is None:
+        tier = next((t for t in MODEL_PRICING if t in model), DEFAULT_PRICING_TIER)
+        _model_tiers[model] = tier
+    return tier
+
+
 # --- System Prompts ---
 
 ROAST_PROMPT = """You are an AI that reviews human-written code with brutal honesty and genuine humor.
@@ -45,7 +120,7 @@ just that good." Never fake criticism to fill space. Credibility > comedy.
 If the code is mediocre, roast it normally but be fair.
 If the code is bad, go to town. That's where the fun is.
 
-Severity: {severity}
+Severity levels (the one to use is given at the end):
 - gentle: Light teasing, encouraging. "This is fine, but let me show you the better way."
 - normal: Standard roast. Real talk with jokes. Clear Claude Code callouts.
 - brutal: Gordon Ramsay energy. No mercy, but every criticism is technically accurate.
@@ -58,9 +133,7 @@ Rules:
 - Claude Code references should feel natural, not like an ad read. Work them into the
   roast commentary, don't bolt them on at the end as a separate section.
 - Keep it under 600 words
-- Output format: markdown with a "Roast Score: X/100" header
-
-Language detected: {language}"""
+- Output format: markdown with a "Roast Score: X/100" header"""
 
 WALDORF_PROMPT = """You are writing a code review as a dialogue between Statler and Waldorf,
 the two grumpy old hecklers from The Muppet Show who sit in the balcony box and roast
@@ -146,7 +219,7 @@ Guidelines:
 9. Use their self-aware paradox: they complain about bad code but secretly love
    having something to heckle
 
-Severity: {severity}
+Severity levels (the one to use is given at the end):
 - gentle: Fond grumbling. They've seen worse. Backhanded compliments mixed with
   "Do-ho-ho-ho!" chuckles. They might even admit it's "not the worst we've seen."
 - normal: Classic heckling. Real issues delivered as rapid-fire banter with hearty
@@ -165,9 +238,7 @@ Rules:
 - Keep it under 700 words (dialogue format runs slightly longer)
 - Include "Roast Score: X/100" — have them bicker about whether it should be higher or lower
 - SCORING DIRECTION: 0 = impressive code, 100 = disaster. Higher score = worse code. NEVER invert this.
-- Their laughs ("Do-ho-ho-ho-ho!") are MANDATORY — at least 2-3 per review
-
-Language detected: {language}"""
+- Their laughs ("Do-ho-ho-ho-ho!") are MANDATORY — at least 2-3 per review"""
 
 SERIOUS_PROMPT = """You are a senior developer with 15+ years of experience performing a thorough
 code review. Provide:
@@ -182,13 +253,34 @@ Be direct and constructive. No filler. Reference specific lines.
 If the code is well-written, say so — acknowledge what's done right before
 diving into improvements. Don't manufacture criticism.
 Keep it under 800 words.
-Output format: markdown with severity tags (🔴 Critical, 🟡 Warning, 🔵 Suggestion)
+Output format: markdown with severity tags (🔴 Critical, 🟡 Warning, 🔵 Suggestion)"""
+
+
+# Everything above is static and sent as a prompt-cached block, so the
+# cached prefix is byte-identical across requests. Only a small trailer
+# (severity, language, flavor) built in roast_code varies per request and
+# goes in an uncached block after it.
+#
+# The API only caches a prefix once it reaches the model's minimum: 4096
+# tokens on Haiku 4.5 (the default model), 1024 on Sonnet. These prompts are
+# roughly 580 (roast), 1450 (waldorf) and 160 (serious) tokens, so with the
+# shipped config cache_control is a no-op and usage shows cache_read=0; on
+# Sonnet only waldorf qualifies. Below the minimum it is billed normally.
+
+
+def _cached_block(prompt: str) -> dict:
+    return {"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}
 
-Language detected: {language}"""
+
+CACHED_PROMPT_BLOCKS = {
+    'roast': _cached_block(ROAST_PROMPT),
+    'waldorf': _cached_block(WALDORF_PROMPT),
+    'serious': _cached_block(SERIOUS_PROMPT),
+}
 
 # --- Flavor Rotation ---
 
-ROAST_FLAVORS = [
+ROAST_FLAVORS = (
     "Channel the energy of a disappointed parent looking at a report card. 'We have AI at home and you still wrote this?'",
     "Write like you're a nature documentary narrator observing human-written code in its natural habitat, marveling at how it survives without AI assistance.",
     "Pretend you're a food critic, but the dish is this code and Claude Code is the Michelin-star kitchen they could have used.",
@@ -201,43 +293,114 @@ ROAST_FLAVORS = [
     "Write as a movie reviewer. This code is the indie film. Claude Code is the blockbuster remake that fixes the plot holes.",
     "You're a museum tour guide showing visitors an exhibit of 'Code Written Before AI.' Equal parts respect and pity.",
     "Channel a sommelier. 'This code has notes of... desperation. A hint of Stack Overflow. Aged poorly. Might I suggest a finer vintage?'",
-]
+)
+_N_FLAVORS = len(ROAST_FLAVORS)
+
+# Private generator for flavor picks; reseeded in forked workers so a preloaded
+# app doesn't hand every gunicorn worker the same flavor sequence
+_RNG = random.Random()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_RNG.seed)
 
 
 def get_roast_flavor() -> str:
-    return random.choice(ROAST_FLAVORS)
+    return ROAST_FLAVORS[_RNG.randrange(_N_FLAVORS)]
+
+
+# --- Token Estimation ---
+
+DEFAULT_TOKENS_PER_CHAR = 0.25
+
+# Characters sent besides the code and system prompt: the trailer and
+# user-message framing (a generous allowance). The system prompt's length
+# is added per mode in PROMPT_OVERHEAD_CHARS.
+PROMPT_FRAMING_CHARS = 200
+
+# (characters sent, input tokens billed) from recent API responses
+_token_samples: deque[tuple[int, int]] = deque(maxlen=200)
+
+
+def record_token_sample(chars: int, tokens: int) -> None:
+    """Remember how many input tokens a request of this many characters cost."""
+    if chars > 0 and tokens > 0:
+        _token_samples.append((chars, tokens))
+
+
+def tokens_per_char() -> float:
+    """Observed input tokens per character across recent calls.
+
+    A sqrt(chars)-weighted mean of the per-call ratios: bigger requests
+    count for more, without a few huge ones drowning out the rest.
+    """
+    samples = tuple(_token_samples)
+    if not samples:
+        return DEFAULT_TOKENS_PER_CHAR
+    weight = sum(math.sqrt(chars) for chars, _ in samples)
+    return sum(tokens / math.sqrt(chars) for chars, tokens in samples) / weight
+
+
+# Per-mode constants for the estimator: prompt characters sent besides the
+# code, and the expected output length (waldorf dialogue runs longer)
+PROMPT_OVERHEAD_CHARS = {mode: len(block['text']) + PROMPT_FRAMING_CHARS
+                         for mode, block in CACHED_PROMPT_BLOCKS.items()}
+ESTIMATED_OUTPUT_TOKENS = {'roast': 700, 'waldorf': 800, 'serious': 700}
+ESTIMATED_OUTPUT_CENTS = {(tier, mode): tokens * rates['output']
+                          for tier, rates in CENTS_PER_TOKEN.items()
+                          for mode, tokens in ESTIMATED_OUTPUT_TOKENS.items()}
+
 
+def prompt_overhead_chars(mode: str) -> int:
+    """Characters a request in this mode sends in addition to the code."""
+    return PROMPT_OVERHEAD_CHARS.get(mode, PROMPT_OVERHEAD_CHARS['roast'])
 
-# --- Cost Estimation ---
 
 def estimate_cost_cents(text: str, model: str, mode: str = "roast") -> float:
     """Rough pre-call cost estimate for gate checking."""
-    input_tokens = len(text) / 4 + 500  # rough char estimate + system prompt
-    output_tokens = 800 if mode == "waldorf" else 700  # waldorf dialogue runs longer
+    if mode not in ESTIMATED_OUTPUT_TOKENS:
+        mode = "roast"
+    tier = get_pricing_tier(model)
+    input_tokens = (len(text) + PROMPT_OVERHEAD_CHARS[mode]) * tokens_per_char()
+    return input_tokens * CENTS_PER_TOKEN[tier]['input'] + ESTIMATED_OUTPUT_CENTS[tier, mode]
 
-    pricing_key = 'haiku' if 'haiku' in model else 'sonnet'
-    pricing = MODEL_PRICING[pricing_key]
 
-    input_cost = (input_tokens / 1_000_000) * pricing['input_per_mtok']
-    output_cost = (output_tokens / 1_000_000) * pricing['output_per_mtok']
-
-    return (input_cost + output_cost) * 100
+def calculate_actual_cost_cents(input_tokens: int, cached_input_tokens: int,
+                                cache_creation_tokens: int, output_tokens: int, model: str) -> float:
+    """Calculate actual cost from API response usage data.
 
+    Sums every billing category: uncached input, cache reads, cache writes
+    and output, each at its own rate.
+    """
+    rates = CENTS_PER_TOKEN[get_pricing_tier(model)]
+    return (input_tokens * rates['input']
+            + cached_input_tokens * rates['cached_input']
+            + cache_creation_tokens * rates['cache_write']
+            + output_tokens * rates['output'])
 
-def calculate_actual_cost_cents(input_tokens: int, output_tokens: int, model: str) -> float:
-    """Calculate actual cost from API response usage data."""
-    pricing_key = 'haiku' if 'haiku' in model else 'sonnet'
-    pricing = MODEL_PRICING[pricing_key]
 
-    input_cost = (input_tokens / 1_000_000) * pricing['input_per_mtok']
-    output_cost = (output_tokens / 1_000_000) * pricing['output_per_mtok']
+ROAST_SCORE_RE = re.compile(r'Roast Score[:\s]*(\d{1,3})\s*/\s*100', re.IGNORECASE)
 
-    return (input_cost + output_cost) * 100
+# The score is nearly always in the header or the closing verdict
+SCORE_SCAN_CHARS = 400
+SCORE_HEADER = "Roast Score: "
 
 
 def extract_roast_score(roast_text: str) -> int | None:
-    """Pull the roast score out of Claude's markdown response."""
-    match = re.search(r'Roast Score[:\s]*(\d{1,3})\s*/\s*100', roast_text, re.IGNORECASE)
+    """Pull the roast score out of Claude's markdown response.
+
+    The literal "Roast Score: NN/100" header is checked without the regex;
+    otherwise the head and tail are searched, then the full text.
+    """
+    start = roast_text.find(SCORE_HEADER, 0, SCORE_SCAN_CHARS)
+    if start != -1:
+        start += len(SCORE_HEADER)
+        end = roast_text.find('/100', start, start + 7)
+        digits = roast_text[start:end]
+        if end != -1 and digits.isdecimal():
+            return min(int(digits), 100)
+
+    match = (ROAST_SCORE_RE.search(roast_text, 0, SCORE_SCAN_CHARS)
+             or ROAST_SCORE_RE.search(roast_text, max(0, len(roast_text) - SCORE_SCAN_CHARS))
+             or ROAST_SCORE_RE.search(roast_text))
     if match:
         score = int(match.group(1))
         return min(score, 100)
@@ -246,6 +409,9 @@ def extract_roast_score(roast_text: str) -> int | None:
 
 # --- Mock Response ---
 
+# Mock text only needs the year; a long-running dev server can live with it going stale
+_CURRENT_YEAR = datetime.now().year
+
 MOCK_ROAST = """## Roast Score: 65/100
 
 Oh, what do we have here? A human actually typed this out? By hand? In {year}?
@@ -340,91 +506,442 @@ Hard-coded values should be moved to named constants for clarity and maintainabi
 **Overall:** The code is functional but would benefit from defensive programming practices and clearer naming conventions.
 """
 
+# Final mock text and score per mode, built once so mock mode is a lookup
+MOCK_TEXTS = {
+    "roast": MOCK_ROAST.format(year=_CURRENT_YEAR),
+    "waldorf": MOCK_WALDORF,
+    "serious": MOCK_SERIOUS,
+}
+MOCK_SCORES = {mode: extract_roast_score(text) for mode, text in MOCK_TEXTS.items()}
+
+
+# --- Response Cache ---
+# Re-submitting the same paste in the same mode returns the stored review for
+# free. Roast mode is never cached: the rotating flavor is the point. Cached
+# modes are requested at temperature 0 so a stored answer is the answer.
+# RESPONSE_CACHE_TTL=0 turns the cache off.
+
+RESPONSE_CACHE_SIZE = 512
+DEFAULT_RESPONSE_CACHE_TTL = 3600.0
+
+
+def _response_cache_ttl() -> float:
+    """RESPONSE_CACHE_TTL from the environment; a malformed value falls back to the default."""
+    raw = os.environ.get('RESPONSE_CACHE_TTL')
+    if raw is None:
+        return DEFAULT_RESPONSE_CACHE_TTL
+    try:
+        ttl = float(raw)
+    except ValueError:
+        ttl = math.nan
+    if not math.isfinite(ttl):
+        logger.warning("Ignoring malformed RESPONSE_CACHE_TTL=%r; using %ss",
+                       raw, DEFAULT_RESPONSE_CACHE_TTL)
+        return DEFAULT_RESPONSE_CACHE_TTL
+    return ttl
+
+
+RESPONSE_CACHE_TTL = _response_cache_ttl()
+_response_cache: OrderedDict = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def _response_key(code: str, mode: str, severity: str, model: str) -> tuple:
+    """Cache key for a review; serious mode ignores severity."""
+    digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    return (mode, severity if mode == "waldorf" else None, model, digest)
+
+
+def _cached_response(key: tuple) -> RoastResult | None:
+    """A stored, unexpired result re-labelled as a free cache hit, or None."""
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if time.monotonic() >= expires:
+            del _response_cache[key]
+            return None
+        _response_cache.move_to_end(key)
+    return result._replace(tokens_used=0, input_tokens=0, output_tokens=0,
+                           cost_cents=0.0, model=result.model + "+cache")
+
+
+def _store_response(key: tuple, result: RoastResult) -> None:
+    with _response_cache_lock:
+        _response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, result)
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _anthropic():
+    """Import the anthropic SDK on first use; it pulls in httpx/pydantic."""
+    import anthropic
+    return anthropic
 
-def roast_code(code: str, mode: str = "roast", severity: str = "normal") -> dict:
-    """Main entry point: roast or review code using Claude API.
 
-    If ANTHROPIC_API_KEY is not set, returns a mock response for local testing.
+@lru_cache(maxsize=1)
+def _claude_caller():
+    """Build the retry-wrapped streaming call once per process."""
+    from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+    anthropic = _anthropic()
+
+    @retry(
+        stop=stop_after_attempt(2),
+        wait=wait_exponential(min=1, max=4),
+        retry=retry_if_exception_type((anthropic.APIStatusError, anthropic.APIConnectionError)),
+    )
+    def call_claude(client, on_chunk=None, **kwargs):
+        with client.messages.stream(**kwargs) as stream:
+            if on_chunk is not None:
+                for text in stream.text_stream:
+                    on_chunk(text)
+            return stream.get_final_message()
+
+    return call_claude
+
+
+@lru_cache(maxsize=4)
+def _client(api_key: str) -> "anthropic.Anthropic":
+    """One client per API key so its HTTP connection pool is reused across roasts."""
+    return _anthropic().Anthropic(api_key=api_key)
+
+
+# --- Message Batches ---
+# Latency-tolerant callers (seeding, bulk jobs) can go through the Batches
+# API at half price. Never used for interactive web requests.
+
+BATCH_DISCOUNT = 0.5
+BATCH_MAX_WAIT = 60 * 60  # seconds before giving up and calling synchronously
+
+
+@lru_cache(maxsize=1)
+def _batch_poller():
+    """Build the backoff poll that waits for a batch to finish processing.
+
+    Transient errors are retried like an unfinished batch, so one failed poll
+    doesn't abandon a batch that is still running (and billing).
     """
-    language = detect_language(code)
-    model = get_config('default_model', 'claude-haiku-4-5-20251001')
+    from tenacity import (retry, retry_if_exception_type, retry_if_result,
+                          stop_after_delay, wait_exponential)
+    anthropic = _anthropic()
+
+    @retry(
+        stop=stop_after_delay(BATCH_MAX_WAIT),
+        wait=wait_exponential(min=2, max=60),
+        retry=(retry_if_result(lambda batch: batch.processing_status != "ended")
+               | retry_if_exception_type((anthropic.APIConnectionError, anthropic.InternalServerError))),
+    )
+    def poll_batch(client, batch_id):
+        return client.messages.batches.retrieve(batch_id)
+
+    return poll_batch
+
+
+def _call_claude_batch(client, **params):
+    """Run one request through the Batches API. Returns the message, or None on failure."""
+    from tenacity import RetryError
+    anthropic = _anthropic()
+
+    batch_id = None
+    try:
+        batch_id = client.messages.batches.create(
+            requests=[{"custom_id": "roast", "params": params}]
+        ).id
+        _batch_poller()(client, batch_id)
+        for entry in client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                return entry.result.message
+            logger.warning("Batch %s request %s", batch_id, entry.result.type)
+        return None  # errored and expired requests aren't billed
+    except RetryError:
+        logger.warning("Batch %s still running after %ds", batch_id, BATCH_MAX_WAIT)
+    except anthropic.APIError as e:
+        logger.warning("Batch request failed: %s", e)
+
+    if batch_id is not None:
+        # Best effort. The request may still complete (or already have) before
+        # the cancel lands; that spend is billed but never recorded, and the
+        # fallback call is charged at full price.
+        logger.warning("Cancelling batch %s; any spend on it goes untracked", batch_id)
+        try:
+            client.messages.batches.cancel(batch_id)
+        except anthropic.APIError as e:
+            logger.warning("Batch %s cancel failed: %s", batch_id, e)
+    return None
+
 
-    # Build the system prompt and set max_tokens
+def _build_prompt(mode: str, severity: str, language: str | None) -> tuple[str, list, int]:
+    """System blocks (cached static prompt + per-request trailer) and max_tokens for a mode.
+
+    Unknown modes fall back to roast; the normalized mode is returned first.
+    language=None leaves the language line out (multi-snippet fences carry it).
+    Caps track each prompt's word budget (~1.35 tokens/word) so rambling stops early.
+    """
     if mode == "waldorf":
-        system = WALDORF_PROMPT.format(severity=severity, language=language)
+        lines = [f"Severity: {severity}"]
         max_tokens = 1200
     elif mode == "serious":
-        system = SERIOUS_PROMPT.format(language=language)
-        max_tokens = 1024
+        lines = []
+        max_tokens = 1100
     else:
-        system = ROAST_PROMPT.format(severity=severity, language=language)
-        system += f"\nStyle direction: {get_roast_flavor()}"
-        max_tokens = 1024
+        mode = "roast"
+        lines = [f"Severity: {severity}"]
+        max_tokens = 850
+    if language is not None:
+        lines.append(f"Language detected: {language}")
+    if mode == "roast":
+        lines.append(f"Style direction: {get_roast_flavor()}")
+    system = [CACHED_PROMPT_BLOCKS[mode]]
+    if lines:
+        system.append({"type": "text", "text": "\n".join(lines)})
+    return mode, system, max_tokens
+
+
+def _account_usage(response, mode: str, code_chars: int) -> tuple[int, int, float]:
+    """(input_tokens, output_tokens, cost_cents) for a response; feeds the token estimator."""
+    # With prompt caching, usage.input_tokens only counts the uncached part
+    usage = response.usage
+    cache_read_tokens = usage.cache_read_input_tokens or 0
+    cache_write_tokens = usage.cache_creation_input_tokens or 0
+    input_tokens = usage.input_tokens + cache_read_tokens + cache_write_tokens
+    logger.info("Claude usage (%s): input=%d cache_read=%d cache_write=%d output=%d",
+                mode, usage.input_tokens, cache_read_tokens, cache_write_tokens, usage.output_tokens)
+
+    cost = calculate_actual_cost_cents(
+        usage.input_tokens,
+        cache_read_tokens,
+        cache_write_tokens,
+        usage.output_tokens,
+        response.model
+    )
+    record_token_sample(code_chars + prompt_overhead_chars(mode), input_tokens)
+    return input_tokens, usage.output_tokens, cost
+
+
+def roast_code(code: str, mode: str = "roast", severity: str = "normal",
+               on_chunk=None, on_complete=None, batch: bool = False,
+               language: str | None = None) -> RoastResult:
+    """Main entry point: roast or review code using Claude API.
+
+    If ANTHROPIC_API_KEY is not set, returns a mock response for local testing.
+    The RoastResult also carries input_chars/input_lines so callers needn't re-scan code.
+    The response is streamed; on_chunk, if given, receives each text delta as it
+    arrives (chunks restart from scratch if the call is retried), and
+    on_complete receives the finished RoastResult before it is returned.
+    batch=True sends the request through the discounted Batches API and blocks
+    until it finishes, falling back to a normal call if the batch fails.
+    Pass language if the caller already detected it (see validate_and_detect).
+    """
+    result = _roast(code, mode, severity, on_chunk, batch, language)
+    if on_complete is not None:
+        on_complete(result)
+    return result
+
+
+def _roast(code: str, mode: str, severity: str, on_chunk, batch: bool,
+           language: str | None) -> RoastResult:
+    if language is None:
+        language = detect_language(code)
+    input_chars = len(code)
+    input_lines = code.count('\n') + 1
+
+    mode, system, max_tokens = _build_prompt(mode, severity, language)
 
     api_key = os.environ.get('ANTHROPIC_API_KEY')
 
     if not api_key:
         # Mock mode for local testing
         logger.info("No ANTHROPIC_API_KEY set — returning mock response")
-        from datetime import datetime
-        if mode == "waldorf":
-            mock_text = MOCK_WALDORF
-        elif mode == "serious":
-            mock_text = MOCK_SERIOUS
-        else:
-            mock_text = MOCK_ROAST.format(year=datetime.now().year)
-        score = extract_roast_score(mock_text)
-        return {
-            "roast": mock_text,
-            "tokens_used": 0,
-            "input_tokens": 0,
-            "output_tokens": 0,
-            "cost_cents": 0.0,
-            "model": "mock",
-            "language": language,
-            "score": score,
-        }
-
-    # Real API call
-    import anthropic
-    from tenacity import retry, stop_after_attempt, wait_exponential
-
-    client = anthropic.Anthropic(api_key=api_key)
-
-    @retry(
-        stop=stop_after_attempt(2),
-        wait=wait_exponential(min=1, max=4),
-        retry=lambda retry_state: isinstance(
-            retry_state.outcome.exception(),
-            (anthropic.APIStatusError, anthropic.APIConnectionError)
-        ) if retry_state.outcome.exception() else False,
-    )
-    def call_claude():
-        return client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            system=system,
-            messages=[{"role": "user", "content": f"Review this code:\n\n```{language}\n{code}\n```"}]
+        mock_text = MOCK_TEXTS[mode]
+        if on_chunk is not None:
+            on_chunk(mock_text)
+        score = MOCK_SCORES[mode]
+        return RoastResult(
+            roast=mock_text,
+            tokens_used=0,
+            input_tokens=0,
+            output_tokens=0,
+            cost_cents=0.0,
+            model="mock",
+            language=language,
+            score=score,
+            input_chars=input_chars,
+            input_lines=input_lines,
         )
 
-    response = call_claude()
+    # get_config is served from the 30s snapshot, so admin model changes apply quickly
+    model = get_config('default_model', 'claude-haiku-4-5-20251001')
+    cache_key = None
+    if mode != "roast" and RESPONSE_CACHE_TTL > 0:
+        cache_key = _response_key(code, mode, severity, model)
+        cached = _cached_response(cache_key)
+        if cached is not None:
+            if on_chunk is not None:
+                on_chunk(cached.roast)
+            return cached
+
+    # Refuse pathological inputs before paying for them
+    estimate = estimate_cost_cents(code, model, mode)
+    if estimate > float(get_config('max_cents_per_call', '10')):
+        raise RoastTooExpensive(f"Estimated {estimate:.2f}c exceeds per-call cap")
+
+    # Real API call; the user turn is built once and reused across retries
+    user_msg = f"Review this code:\n\n```{language}\n{code}\n```"
+    client = _client(api_key)
+    params = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": system,
+        "messages": [{"role": "user", "content": user_msg}],
+        "temperature": 0.0 if cache_key is not None else 1.0,
+    }
+    response = _call_claude_batch(client, **params) if batch else None
+    discount = BATCH_DISCOUNT
+    if response is None:
+        response = _claude_caller()(client, on_chunk, **params)
+        discount = 1.0
+    elif on_chunk is not None:
+        on_chunk(response.content[0].text)
 
-    actual_cost = calculate_actual_cost_cents(
-        response.usage.input_tokens,
-        response.usage.output_tokens,
-        response.model
-    )
+    input_tokens, output_tokens, actual_cost = _account_usage(response, mode, len(code))
+    actual_cost *= discount
 
     roast_text = response.content[0].text
     score = extract_roast_score(roast_text)
 
-    return {
-        "roast": roast_text,
-        "tokens_used": response.usage.input_tokens + response.usage.output_tokens,
-        "input_tokens": response.usage.input_tokens,
-        "output_tokens": response.usage.output_tokens,
-        "cost_cents": actual_cost,
-        "model": response.model,
-        "language": language,
-        "score": score,
-    }
+    result = RoastResult(
+        roast=roast_text,
+        tokens_used=input_tokens + output_tokens,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost_cents=actual_cost,
+        model=response.model,
+        language=language,
+        score=score,
+        input_chars=input_chars,
+        input_lines=input_lines,
+    )
+    if cache_key is not None:
+        _store_response(cache_key, result)
+    return result
+
+
+# --- Multi-snippet Roasts ---
+# Several snippets share one system prompt and one API call. Smaller models
+# lose track of which review belongs to which snippet sooner, hence the caps.
+
+MULTI_SNIPPET_LIMITS = {'haiku': 8, 'sonnet': 16}
+# Tiers without an entry get the cautious limit
+DEFAULT_MULTI_SNIPPET_LIMIT = 8
+
+MULTI_SNIPPET_INSTRUCTIONS = (
+    "Review each snippet below on its own, following your instructions for every one. "
+    "Respond with only a JSON array of strings: one complete markdown review per snippet, "
+    "in the same order as the snippets."
+)
+
+
+def _parse_reviews(text: str, count: int) -> list[str]:
+    """Pull the JSON array of reviews out of a multi-snippet reply. Raises ValueError."""
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end < start:
+        raise ValueError("no JSON array in reply")
+    reviews = json.loads(text[start:end + 1])
+    if (not isinstance(reviews, list) or len(reviews) != count
+            or not all(isinstance(r, str) for r in reviews)):
+        raise ValueError(f"expected {count} reviews")
+    return reviews
+
+
+def _roast_group(group: list[str], mode: str, severity: str, model: str, api_key: str) -> list[RoastResult]:
+    """One API call for a group sized by roast_code_batch; usage is split evenly across them."""
+    languages = [detect_language(code) for code in group]
+    # Each fence names its snippet's language, so the trailer leaves it out
+    mode, system, max_tokens = _build_prompt(mode, severity, None)
+    parts = [MULTI_SNIPPET_INSTRUCTIONS]
+    for i, (code, language) in enumerate(zip(group, languages), 1):
+        parts.append(f"## Snippet {i}\n\n```{language}\n{code}\n```")
+    user_msg = "\n\n".join(parts)
+
+    response = _claude_caller()(
+        _client(api_key),
+        model=model,
+        max_tokens=max_tokens * len(group),
+        system=system,
+        messages=[{"role": "user", "content": user_msg}],
+    )
+    input_tokens, output_tokens, cost = _account_usage(response, mode, len(user_msg))
+    count = len(group)
+
+    try:
+        reviews = _parse_reviews(response.content[0].text, count)
+    except ValueError as e:
+        # Already paid for; carry that cost on the one-by-one retries so the budget sees it
+        logger.warning("Multi-snippet reply unusable (%s) — roasting one by one", e)
+        results = []
+        for code in group:
+            try:
+                result = roast_code(code, mode=mode, severity=severity)
+            except Exception as exc:
+                raise RoastBatchIncomplete(results, cost * (count - len(results)) / count) from exc
+            results.append(result._replace(cost_cents=result.cost_cents + cost / count))
+        return results
+
+    return [RoastResult(
+        roast=review,
+        tokens_used=(input_tokens + output_tokens) // count,
+        input_tokens=input_tokens // count,
+        output_tokens=output_tokens // count,
+        cost_cents=cost / count,
+        model=response.model,
+        language=language,
+        score=extract_roast_score(review),
+        input_chars=len(code),
+        input_lines=code.count('\n') + 1,
+    ) for review, code, language in zip(reviews, group, languages)]
+
+
+def roast_code_batch(snippets: list[str], mode: str = "roast", severity: str = "normal") -> list[RoastResult]:
+    """Roast many snippets, packing several into each API call.
+
+    Returns one RoastResult per snippet, in order. Meant for bulk
+    jobs ("roast my whole repo"); the web form roasts one paste at a time.
+    Raises RoastTooExpensive before any call if a single snippet is over the
+    per-call cap; groups are packed so their summed estimate stays under it.
+    If a call fails after others were paid for, raises RoastBatchIncomplete
+    carrying the finished results so their spend can still be recorded.
+    """
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if not api_key:
+        return [roast_code(code, mode=mode, severity=severity) for code in snippets]
+
+    model = get_config('default_model', 'claude-haiku-4-5-20251001')
+    size = MULTI_SNIPPET_LIMITS.get(get_pricing_tier(model), DEFAULT_MULTI_SNIPPET_LIMIT)
+    cap = float(get_config('max_cents_per_call', '10'))
+    estimates = [estimate_cost_cents(code, model, mode) for code in snippets]
+    for estimate in estimates:
+        if estimate > cap:
+            raise RoastTooExpensive(f"Estimated {estimate:.2f}c exceeds per-call cap")
+
+    groups, group, group_cost = [], [], 0.0
+    for code, estimate in zip(snippets, estimates):
+        if group and (len(group) == size or group_cost + estimate > cap):
+            groups.append(group)
+            group, group_cost = [], 0.0
+        group.append(code)
+        group_cost += estimate
+    if group:
+        groups.append(group)
+
+    results = []
+    for group in groups:
+        try:
+            results.extend(_roast_group(group, mode, severity, model, api_key))
+        except RoastBatchIncomplete as e:
+            raise RoastBatchIncomplete(results + e.results, e.unassigned_cents) from e.__cause__
+        except Exception as e:
+            raise RoastBatchIncomplete(results) from e
+    return results
@@ -1,15 +1,18 @@
 """Input validation, markdown sanitization, share ID generation."""
 
+import math
 import re
 import secrets
+from functools import lru_cache
 
-import bleach
-import markdown as md
+import cmarkgfm
 
-from app.config import get_config
+from app.config import get_configs
+from app.language_detect import detect_language
 
 # Words that could look offensive in a URL
 BLOCKLIST = {'ass', 'fuk', 'fck', 'nig', 'fag', 'cum', 'sex', 'wtf', 'die', 'kys'}
+BLOCKLIST_RE = re.compile('|'.join(map(re.escape, sorted(BLOCKLIST))), re.IGNORECASE)
 
 # Allowed HTML tags in rendered roast markdown
 ALLOWED_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'strong', 'em', 'code', 'pre',
@@ -18,6 +21,10 @@ ALLOWED_ATTRS = {
     'code': ['class'],
     'span': ['class'],
 }
+ALLOWED_PROTOCOLS = ['http', 'https', 'mailto']
+
+# Markdown punctuation stripped from previews
+MD_STRIP_TABLE = str.maketrans('', '', '#*_`[]()')
 
 
 def validate_input(code: str) -> tuple[bool, str]:
@@ -25,40 +32,73 @@ def validate_input(code: str) -> tuple[bool, str]:
     if not code or not code.strip():
         return False, "Paste some code first. We can't roast nothing."
 
-    max_chars = int(get_config('max_input_chars', '15000'))
-    max_lines = int(get_config('max_input_lines', '500'))
+    limits = get_configs({'max_input_chars': '15000', 'max_input_lines': '500'})
+    max_chars = int(limits['max_input_chars'])
+    max_lines = int(limits['max_input_lines'])
 
     if len(code) > max_chars:
         return False, f"Too long ({len(code):,} chars). Max is {max_chars:,}."
 
-    line_count = len(code.split('\n'))
+    line_count = code.count('\n') + 1
     if line_count > max_lines:
         return False, f"Too many lines ({line_count}). Max is {max_lines}. Paste the worst part."
 
     return True, ""
 
 
+def validate_and_detect(code: str) -> tuple[bool, str, str]:
+    """Validate code input and detect its language. Returns (valid, error_message, language).
+
+    Detection only runs on input that passed validation; language is "" otherwise.
+    """
+    valid, error_msg = validate_input(code)
+    if not valid:
+        return False, error_msg, ""
+    return True, "", detect_language(code)
+
+
+@lru_cache(maxsize=1)
+def _sanitizer():
+    """Build the HTML sanitizer once: nh3 (Rust) when installed, else bleach."""
+    # Deferred: only rendering needs these, and bleach (html5lib) is slow to import
+    try:
+        import nh3
+    except ImportError:
+        import bleach
+        return lambda html: bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS,
+                                         protocols=ALLOWED_PROTOCOLS, strip=True)
+    # '*' replaces nh3's default generic attributes (lang, title) with none
+    cleaner = nh3.Cleaner(tags=set(ALLOWED_TAGS),
+                          attributes={'*': set(),
+                                      **{tag: set(attrs) for tag, attrs in ALLOWED_ATTRS.items()}},
+                          generic_attribute_prefixes=set(),
+                          url_schemes=set(ALLOWED_PROTOCOLS))
+    return cleaner.clean
+
+
 def render_roast_markdown(text: str) -> str:
     """Convert markdown to sanitized HTML."""
-    html = md.markdown(text, extensions=['fenced_code', 'codehilite', 'tables'])
-    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS,
-                        protocols=['http', 'https', 'mailto'], strip=True)
+    # cmark-gfm handles fenced code and tables natively; raw HTML in the
+    # source is omitted before the sanitizer even sees it. Unlike stripping
+    # tags in the sanitizer, that drops HTML blocks whole, text included.
+    html = cmarkgfm.github_flavored_markdown_to_html(text)
+    return _sanitizer()(html)
 
 
 def generate_share_id(length: int = 8) -> str:
     """Generate a URL-safe share ID, avoiding offensive substrings."""
+    # Each base64 char carries 6 bits, so draw just enough bytes for `length` chars
+    nbytes = math.ceil(length * 3 / 4)
     while True:
-        candidate = secrets.token_urlsafe(length)[:length]
-        lower = candidate.lower()
-        if not any(word in lower for word in BLOCKLIST):
+        candidate = secrets.token_urlsafe(nbytes)[:length]
+        if not BLOCKLIST_RE.search(candidate):
             return candidate
 
 
 def get_roast_preview(roast_text: str, max_length: int = 150) -> str:
     """Get a plain text preview of a roast for OG tags and feeds."""
-    # Strip markdown formatting
-    plain = re.sub(r'[#*_`\[\]()]', '', roast_text)
-    plain = re.sub(r'\n+', ' ', plain).strip()
+    # Strip markdown formatting; whitespace runs collapse to single spaces
+    plain = ' '.join(roast_text.translate(MD_STRIP_TABLE).split())
     if len(plain) > max_length:
         return plain[:max_length].rsplit(' ', 1)[0] + '...'
     return plain
@@ -11,7 +11,7 @@ _tmpdir = tempfile.mkdtemp()
 os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmpdir, "test.db")}'
 
 from app.db import init_db, get_db
-from app.budget import get_month_spend, record_cost, check_budget, get_current_month
+from app.budget import get_month_spend, record_cost, check_budget, get_current_month, clear_budget_cache
 
 
 def setup_function():
@@ -19,6 +19,7 @@ def setup_function():
     init_db()
     with get_db() as db:
         db.execute("DELETE FROM monthly_budget")
+    clear_budget_cache()
 
 
 def test_initial_spend_is_zero():
@@ -72,3 +73,45 @@ def test_get_current_month_format():
     month = get_current_month()
     assert len(month) == 7  # 'YYYY-MM'
     assert month[4] == '-'
+
+
+def test_spend_served_from_cache_until_cleared():
+    record_cost(2.0)
+    assert get_month_spend() == 2.0
+
+    # Writes that bypass record_cost aren't seen until the cache is dropped
+    with get_db() as db:
+        db.execute("UPDATE monthly_budget SET spent_cents = 7.0")
+    assert get_month_spend() == 2.0
+
+    clear_budget_cache()
+    assert get_month_spend() == 7.0
+
+
+def test_record_cost_refreshes_from_table():
+    record_cost(1.0)
+    with get_db() as db:
+        db.execute("UPDATE monthly_budget SET spent_cents = spent_cents + 5.0")  # another worker
+    record_cost(1.0)
+    assert get_month_spend() == 7.0
+
+
+def test_rolled_back_cost_not_mirrored():
+    record_cost(16.0)
+    try:
+        with get_db():
+            record_cost(5.0)  # joins the outer transaction, like submit_roast
+            raise RuntimeError("record_usage failed")
+    except RuntimeError:
+        pass
+    assert get_month_spend() == 16.0
+    clear_budget_cache()
+    assert get_month_spend() == 16.0
+
+
+def test_committed_cost_mirrored_after_outer_commit():
+    with get_db():
+        record_cost(3.0)
+    with get_db() as db:
+        db.execute("UPDATE monthly_budget SET spent_cents = 99.0")  # bypasses the mirror
+    assert get_month_spend() == 3.0
@@ -0,0 +1,47 @@
+"""Tests for the app_config cache."""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Set up a temp database before importing app modules
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmpdir, "test.db")}'
+
+from app.db import init_db, get_db
+from app.config import get_config, get_configs, set_config, clear_config_cache
+
+
+def setup_function():
+    """Reset database before each test."""
+    init_db()
+    set_config('daily_roasts_per_session', '10')
+
+
+def test_get_config_default_for_missing_key():
+    assert get_config('no_such_key', 'fallback') == 'fallback'
+
+
+def test_get_config_served_from_cache():
+    assert get_config('daily_roasts_per_session') == '10'
+
+    # Writes that bypass set_config aren't seen until the cache is dropped
+    with get_db() as db:
+        db.execute("UPDATE app_config SET value = '99' WHERE key = 'daily_roasts_per_session'")
+    assert get_config('daily_roasts_per_session') == '10'
+
+    clear_config_cache()
+    assert get_config('daily_roasts_per_session') == '99'
+
+
+def test_set_config_invalidates_cache():
+    assert get_config('daily_roasts_per_session') == '10'
+    set_config('daily_roasts_per_session', '4')
+    assert get_config('daily_roasts_per_session') == '4'
+
+
+def test_get_configs_batches_with_defaults():
+    values = get_configs({'daily_roasts_per_session': '1', 'no_such_key': 'x'})
+    assert values == {'daily_roasts_per_session': '10', 'no_such_key': 'x'}
@@ -0,0 +1,79 @@
+"""Tests for schema setup and migration."""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Set up a temp database before importing app modules
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmpdir, "test.db")}'
+
+from app import db as db_module
+from app.db import init_db, get_db
+
+
+def setup_function():
+    init_db()
+
+
+def test_migrates_legacy_daily_usage_in_one_transaction():
+    with get_db() as db:
+        db.execute("DROP TABLE daily_usage")
+        db.execute("""CREATE TABLE daily_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT, identity TEXT, count INTEGER DEFAULT 0,
+            UNIQUE(date, identity))""")
+        db.execute("INSERT INTO daily_usage (date, identity, count) VALUES ('2025-01-01', 's:abc', 3)")
+
+    writer = db_module._get_writer()
+    seen = []
+    writer.set_trace_callback(lambda sql: seen.append((sql, writer.in_transaction)))
+    try:
+        init_db()
+    finally:
+        writer.set_trace_callback(None)
+
+    # The schema check, migration and seeding all ran inside init_db's one
+    # BEGIN IMMEDIATE, not in autocommit
+    atomic = [(sql, in_txn) for sql, in_txn in seen
+              if "name = 'daily_usage'" in sql or 'daily_usage_legacy' in sql
+              or 'INSERT INTO app_config' in sql]
+    assert atomic and all(in_txn for _, in_txn in atomic)
+    assert sum(sql.startswith('BEGIN') for sql, _ in seen) == 1
+    assert not writer.in_transaction
+
+    with get_db(write=False) as db:
+        table_sql = db.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'daily_usage'"
+        ).fetchone()['sql']
+        rows = db.execute("SELECT date, identity, count FROM daily_usage").fetchall()
+    assert 'WITHOUT ROWID' in table_sql.upper()
+    assert [tuple(r) for r in rows] == [('2025-01-01', 's:abc', 3)]
+
+
+def test_init_db_leaves_no_transaction_open():
+    init_db()
+    assert not db_module._get_writer().in_transaction
+    assert not getattr(db_module._local, 'writing', False)
+
+
+def test_forked_child_opens_its_own_connections():
+    if not hasattr(os, 'fork'):
+        return
+    parent_writer = db_module._get_writer()
+    pid = os.fork()
+    if pid == 0:
+        # Child: anything but a clean exit 0 fails the test
+        try:
+            ok = db_module._writer is None and parent_writer in db_module._inherited
+            with get_db() as db:
+                db.execute("UPDATE app_config SET value = value WHERE key = 'default_model'")
+            ok = ok and db_module._get_writer() is not parent_writer
+        except Exception:
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert db_module._writer is parent_writer
@@ -121,3 +121,15 @@ if [ -f "$FILE" ]; then
 fi
 """
     assert detect_language(code) == "bash"
+
+
+def test_detect_long_input_uses_head():
+    code = "package main\n\nimport \"fmt\"\n\nfunc main() {\n    x := 42\n    fmt.Println(x)\n}\n"
+    code += "// filler line with no signatures\n" * 500
+    assert detect_language(code) == "go"
+
+
+def test_detect_long_input_falls_back_to_full_scan():
+    code = "just some random text\n" * 500
+    code += "SELECT name FROM users WHERE id = 1;\n"
+    assert detect_language(code) == "sql"
@@ -0,0 +1,452 @@
+"""Tests for roast scoring, cost accounting, mock mode and the API path (stubbed client)."""
+
+import sys
+import os
+import json
+import subprocess
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Set up a temp database before importing app modules
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmpdir, "test.db")}'
+
+from app.db import init_db
+from app import roaster
+from app.config import set_config
+from app.roaster import (extract_roast_score, roast_code, calculate_actual_cost_cents,
+                          get_pricing_tier, RoastTooExpensive, RoastResult, roast_code_batch,
+                          RoastBatchIncomplete)
+
+
+def setup_function():
+    init_db()
+    os.environ.pop('ANTHROPIC_API_KEY', None)
+    roaster._token_samples.clear()
+    roaster._response_cache.clear()
+
+
+class FakeStream:
+    def __init__(self, message):
+        self.message = message
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        text = self.message.content[0].text
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
+    def get_final_message(self):
+        return self.message
+
+
+class FakeAPI:
+    """Stands in for an anthropic.Anthropic client: canned replies, recorded calls."""
+    MODEL = 'claude-haiku-4-5-20251001'
+
+    def __init__(self):
+        self.messages = self
+        self.batches = FakeBatches(self)
+        self.calls = []
+        self.fail_calls = set()  # 1-based indexes of stream() calls that raise
+        self.reply = lambda params: "## Roast Score: 77/100\n\nYour code is a crime scene."
+
+    def make_message(self, params):
+        usage = SimpleNamespace(input_tokens=1200, output_tokens=300,
+                                cache_read_input_tokens=None, cache_creation_input_tokens=None)
+        return SimpleNamespace(model=self.MODEL, usage=usage,
+                               content=[SimpleNamespace(type='text', text=self.reply(params))])
+
+    def stream(self, **params):
+        self.calls.append(params)
+        if len(self.calls) in self.fail_calls:
+            raise RuntimeError("stream failed")
+        return FakeStream(self.make_message(params))
+
+
+class FakeBatches:
+    """The messages.batches surface: every batch ends at once with a canned result."""
+
+    def __init__(self, api):
+        self.api = api
+        self.created = []
+        self.cancelled = []
+        self.result_type = 'succeeded'
+        self.retrieve_errors = []  # raised by successive retrieve() calls, in order
+        self.results_error = None
+
+    def create(self, requests):
+        self.created.append(requests)
+        return SimpleNamespace(id=f'batch_{len(self.created)}')
+
+    def retrieve(self, batch_id):
+        if self.retrieve_errors:
+            raise self.retrieve_errors.pop(0)
+        return SimpleNamespace(id=batch_id, processing_status='ended')
+
+    def results(self, batch_id):
+        if self.results_error is not None:
+            raise self.results_error
+        params = self.created[-1][0]['params']
+        message = self.api.make_message(params) if self.result_type == 'succeeded' else None
+        yield SimpleNamespace(custom_id='roast',
+                              result=SimpleNamespace(type=self.result_type, message=message))
+
+    def cancel(self, batch_id):
+        self.cancelled.append(batch_id)
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = FakeAPI()
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr(roaster, '_client', lambda api_key: api)
+    return api
+
+
+def test_extract_score_header():
+    assert extract_roast_score("## Roast Score: 65/100\n\nOh dear.") == 65
+
+
+def test_extract_score_case_and_spacing():
+    assert extract_roast_score("roast score 42 / 100") == 42
+
+
+def test_extract_score_capped_at_100():
+    assert extract_roast_score("Roast Score: 150/100") == 100
+
+
+def test_extract_score_tail_and_middle():
+    filler = "Blah blah. " * 100
+    assert extract_roast_score(filler + "Final Roast Score: 88/100") == 88
+    assert extract_roast_score(filler + "Roast Score: 12/100" + filler) == 12
+
+
+def test_extract_score_missing():
+    assert extract_roast_score("## Code Review\n\nLooks fine.") is None
+
+
+def test_pricing_tier():
+    assert get_pricing_tier('claude-haiku-4-5-20251001') == 'haiku'
+    assert get_pricing_tier('claude-sonnet-4-5') == 'sonnet'
+    assert get_pricing_tier('some-future-model') == 'sonnet'
+
+
+def test_actual_cost_haiku():
+    # 1M input at $0.80 + 1M output at $4.00 = $4.80
+    assert round(calculate_actual_cost_cents(1_000_000, 0, 0, 1_000_000, 'claude-haiku-4-5'), 6) == 480.0
+
+
+def test_actual_cost_bills_cache_reads_and_writes():
+    reads = calculate_actual_cost_cents(0, 1_000_000, 0, 0, 'claude-sonnet-4-5')
+    writes = calculate_actual_cost_cents(0, 0, 1_000_000, 0, 'claude-sonnet-4-5')
+    assert round(reads, 6) == 30.0    # $0.30 / MTok
+    assert round(writes, 6) == 375.0  # $3.75 / MTok
+    assert round(calculate_actual_cost_cents(0, 1_000_000, 1_000_000, 0, 'claude-haiku-4-5'), 6) == 108.0
+
+
+def test_tokens_per_char_default():
+    assert roaster.tokens_per_char() == roaster.DEFAULT_TOKENS_PER_CHAR
+
+
+def test_tokens_per_char_sqrt_weighted():
+    roaster.record_token_sample(100, 50)      # ratio 0.5, weight 10
+    roaster.record_token_sample(10_000, 2000)  # ratio 0.2, weight 100
+    assert abs(roaster.tokens_per_char() - (0.5 * 10 + 0.2 * 100) / 110) < 1e-9
+
+
+def test_estimate_tracks_observed_ratio():
+    before = roaster.estimate_cost_cents("x" * 4000, "claude-haiku-4-5")
+    roaster.record_token_sample(1000, 500)  # code that tokenizes at 2 chars/token
+    assert roaster.estimate_cost_cents("x" * 4000, "claude-haiku-4-5") > before
+
+
+def test_mock_roast_modes():
+    code = "def f(x):\n    return x\n"
+    roast = roast_code(code, mode="roast")
+    assert roast.model == "mock"
+    assert roast.score == 65
+    assert roast.cost_cents == 0.0
+    assert roast.language == "python"
+    assert roast.input_chars == len(code)
+    assert roast.input_lines == 3
+
+    assert roast_code(code, mode="waldorf").score == 72
+    assert roast_code(code, mode="serious").score is None
+
+
+def test_refuses_call_over_cost_cap():
+    set_config('max_cents_per_call', '0.5')
+    os.environ['ANTHROPIC_API_KEY'] = 'test-key'
+    try:
+        with pytest.raises(RoastTooExpensive):
+            roast_code("x = 1\n" * 2000)
+    finally:
+        os.environ.pop('ANTHROPIC_API_KEY', None)
+        set_config('max_cents_per_call', '10')
+
+
+def test_response_cache_hit_is_free():
+    key = roaster._response_key("SELECT 1;", "serious", "normal", "claude-haiku")
+    assert roaster._cached_response(key) is None
+    roaster._store_response(key, RoastResult("Looks fine.", 900, 600, 300, 0.2, "claude-haiku",
+                                             "sql", None, 9, 1))
+    hit = roaster._cached_response(key)
+    assert hit.roast == "Looks fine."
+    assert hit.cost_cents == 0.0
+    assert hit.model == "claude-haiku+cache"
+    # Serious reviews don't depend on severity
+    assert roaster._response_key("SELECT 1;", "serious", "brutal", "claude-haiku") == key
+
+
+def test_response_cache_expires():
+    key = roaster._response_key("SELECT 1;", "serious", "normal", "claude-haiku")
+    roaster._store_response(key, RoastResult("Looks fine.", 900, 600, 300, 0.2, "claude-haiku",
+                                             "sql", None, 9, 1))
+    roaster._response_cache[key] = (0.0, roaster._response_cache[key][1])
+    assert roaster._cached_response(key) is None
+    assert key not in roaster._response_cache
+
+
+def test_parse_multi_snippet_reviews():
+    reply = 'Here you go:\n```json\n["## Roast Score: 40/100\\nMeh.", "## Roast Score: 90/100\\nWow."]\n```'
+    assert roaster._parse_reviews(reply, 2) == ["## Roast Score: 40/100\nMeh.", "## Roast Score: 90/100\nWow."]
+    with pytest.raises(ValueError):
+        roaster._parse_reviews(reply, 3)
+    with pytest.raises(ValueError):
+        roaster._parse_reviews("Sorry, I can't do that.", 1)
+
+
+def test_roast_code_batch_mock():
+    results = roast_code_batch(["x = 1", "def f():\n    pass"], mode="serious")
+    assert len(results) == 2
+    assert all(r.model == "mock" for r in results)
+    assert results[1].input_lines == 2
+
+
+def test_mock_roast_callbacks():
+    chunks, done = [], []
+    result = roast_code("x = 1", mode="waldorf", on_chunk=chunks.append, on_complete=done.append)
+    assert "".join(chunks) == result.roast
+    assert done == [result]
+
+
+def test_roast_result_as_dict():
+    result = roast_code("x = 1", mode="serious")
+    assert result.as_dict()["roast"] == result.roast
+    assert list(result.as_dict()) == list(RoastResult._fields)
+
+
+def test_heavy_sdks_not_imported_at_startup():
+    # Cold start: the SDKs load on first real API call / first render, not at import
+    probe = ("import sys, app.roaster, app.security; "
+             "print(sorted(m for m in ('anthropic', 'tenacity', 'bleach') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                         cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.stdout.strip() == "[]"
+
+
+def test_api_path_streams_and_accounts(fake_api):
+    chunks = []
+    result = roast_code("def f(x):\n    return x\n", mode="roast", on_chunk=chunks.append)
+    assert "".join(chunks) == result.roast
+    assert len(chunks) > 1
+    assert result.score == 77
+    assert result.model == FakeAPI.MODEL
+    # None cache counters count as zero
+    assert result.input_tokens == 1200
+    assert result.output_tokens == 300
+    assert result.cost_cents == pytest.approx(calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL))
+    params = fake_api.calls[0]
+    assert params["max_tokens"] == 850
+    assert params["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert "def f(x)" in params["messages"][0]["content"]
+    # The observed token ratio feeds the next estimate
+    assert len(roaster._token_samples) == 1
+
+
+def test_api_path_caches_serious_but_not_roast(fake_api):
+    code = "SELECT * FROM users;"
+    first = roast_code(code, mode="serious")
+    second = roast_code(code, mode="serious")
+    assert len(fake_api.calls) == 1
+    assert fake_api.calls[0]["temperature"] == 0.0
+    assert second.roast == first.roast
+    assert second.cost_cents == 0.0
+    assert second.model == FakeAPI.MODEL + "+cache"
+
+    roast_code(code, mode="roast")
+    roast_code(code, mode="roast")
+    assert len(fake_api.calls) == 3
+
+
+def test_malformed_response_cache_ttl_falls_back(monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE_TTL', 'an hour')
+    assert roaster._response_cache_ttl() == roaster.DEFAULT_RESPONSE_CACHE_TTL
+    monkeypatch.setenv('RESPONSE_CACHE_TTL', '0')
+    assert roaster._response_cache_ttl() == 0.0
+    monkeypatch.delenv('RESPONSE_CACHE_TTL')
+    assert roaster._response_cache_ttl() == roaster.DEFAULT_RESPONSE_CACHE_TTL
+
+
+def test_batch_path_bills_at_discount(fake_api):
+    code = "print('hello')\n"
+    result = roast_code(code, mode="roast", batch=True)
+    assert len(fake_api.batches.created) == 1
+    assert fake_api.calls == []
+    full = calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL)
+    assert result.cost_cents == pytest.approx(full * roaster.BATCH_DISCOUNT)
+
+
+def test_batch_errored_result_falls_back_at_full_price(fake_api):
+    fake_api.batches.result_type = 'errored'
+    result = roast_code("print('hello')\n", mode="roast", batch=True)
+    assert fake_api.batches.cancelled == []
+    assert len(fake_api.calls) == 1
+    assert result.cost_cents == pytest.approx(calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL))
+
+
+def test_batch_timeout_cancels_and_falls_back(fake_api, monkeypatch, caplog):
+    from tenacity import RetryError
+
+    def never_ends(client, batch_id):
+        raise RetryError(None)
+
+    monkeypatch.setattr(roaster, '_batch_poller', lambda: never_ends)
+    result = roast_code("print('hello')\n", mode="roast", batch=True)
+    assert fake_api.batches.cancelled == ['batch_1']
+    assert len(fake_api.calls) == 1
+    assert result.cost_cents == pytest.approx(calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL))
+    assert "untracked" in caplog.text
+
+
+def connection_error():
+    import anthropic
+    import httpx
+    return anthropic.APIConnectionError(request=httpx.Request('GET', 'https://api.anthropic.com'))
+
+
+def test_batch_poll_survives_transient_error(fake_api, monkeypatch):
+    monkeypatch.setattr(roaster._batch_poller().retry, 'sleep', lambda seconds: None)
+    fake_api.batches.retrieve_errors.append(connection_error())
+    result = roast_code("print('hello')\n", mode="roast", batch=True)
+    assert fake_api.batches.retrieve_errors == []
+    assert fake_api.batches.cancelled == []
+    assert fake_api.calls == []
+    full = calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL)
+    assert result.cost_cents == pytest.approx(full * roaster.BATCH_DISCOUNT)
+
+
+def test_batch_results_failure_cancels_and_falls_back(fake_api, caplog):
+    fake_api.batches.results_error = connection_error()
+    result = roast_code("print('hello')\n", mode="roast", batch=True)
+    assert fake_api.batches.cancelled == ['batch_1']
+    assert len(fake_api.calls) == 1
+    assert result.cost_cents == pytest.approx(calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL))
+    assert "untracked" in caplog.text
+
+
+def multi_snippet_reply(params):
+    """JSON array with one review per snippet in the prompt, or a single review for a lone roast."""
+    count = params["messages"][0]["content"].count("## Snippet ")
+    if not count:
+        return "## Roast Score: 50/100\n\nOne at a time, then."
+    return json.dumps([f"## Roast Score: {10 + i}/100\n\nSnippet {i + 1}." for i in range(count)])
+
+
+def test_roast_code_batch_packs_snippets_into_one_call(fake_api):
+    fake_api.reply = multi_snippet_reply
+    snippets = ["x = 1", "def f():\n    pass", "SELECT 1;"]
+    results = roast_code_batch(snippets, mode="serious")
+    assert len(fake_api.calls) == 1
+    assert fake_api.calls[0]["max_tokens"] == 1100 * 3
+    assert [r.score for r in results] == [10, 11, 12]
+    assert [r.input_chars for r in results] == [len(s) for s in snippets]
+    full = calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL)
+    assert sum(r.cost_cents for r in results) == pytest.approx(full)
+
+
+def test_roast_code_batch_unparseable_reply_falls_back(fake_api):
+    snippets = ["x = 1", "y = 2"]
+    results = roast_code_batch(snippets, mode="serious")
+    # One multi-snippet call, then one per snippet; the wasted call is split across them
+    assert len(fake_api.calls) == 3
+    full = calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL)
+    assert [r.cost_cents for r in results] == [pytest.approx(full * 1.5)] * 2
+    assert all(r.score == 77 for r in results)
+
+
+def test_roast_code_batch_groups_stay_under_cap(fake_api):
+    fake_api.reply = multi_snippet_reply
+    snippets = ["x = 1\n" * 50] * 4
+    one = roaster.estimate_cost_cents(snippets[0], FakeAPI.MODEL, "serious")
+    set_config('max_cents_per_call', str(one * 2.5))
+    try:
+        results = roast_code_batch(snippets, mode="serious")
+    finally:
+        set_config('max_cents_per_call', '10')
+    assert len(results) == 4
+    assert [c["messages"][0]["content"].count("## Snippet ") for c in fake_api.calls] == [2, 2]
+
+
+def test_roast_code_batch_checks_every_snippet_before_calling(fake_api):
+    fake_api.reply = multi_snippet_reply
+    snippets = ["x = 1"] * 9 + ["x = 1\n" * 2000]
+    set_config('max_cents_per_call', '0.5')
+    try:
+        with pytest.raises(RoastTooExpensive):
+            roast_code_batch(snippets, mode="serious")
+    finally:
+        set_config('max_cents_per_call', '10')
+    assert fake_api.calls == []
+
+
+def test_multi_snippet_trailer_and_token_sample(fake_api):
+    fake_api.reply = multi_snippet_reply
+    roast_code_batch(["x = 1", "SELECT 1;"], mode="serious")
+    params = fake_api.calls[0]
+    # Serious mode has no severity, and each fence carries its own language
+    assert len(params["system"]) == 1
+    chars, tokens = roaster._token_samples[-1]
+    assert chars == len(params["messages"][0]["content"]) + roaster.prompt_overhead_chars("serious")
+
+    roast_code_batch(["x = 1", "SELECT 1;"], mode="waldorf", severity="brutal")
+    trailer = fake_api.calls[1]["system"][1]["text"]
+    assert trailer == "Severity: brutal"
+
+
+def test_roast_code_batch_keeps_paid_groups_when_a_later_call_fails(fake_api):
+    fake_api.reply = multi_snippet_reply
+    fake_api.fail_calls = {2}
+    with pytest.raises(RoastBatchIncomplete) as excinfo:
+        roast_code_batch(["x = 1"] * 9, mode="serious")
+    assert len(excinfo.value.results) == roaster.MULTI_SNIPPET_LIMITS['haiku']
+    assert excinfo.value.unassigned_cents == 0.0
+    assert isinstance(excinfo.value.__cause__, RuntimeError)
+
+
+def test_roast_code_batch_fallback_failure_reports_unassigned_spend(fake_api):
+    fake_api.fail_calls = {3}  # multi call, first one-by-one, then the second fails
+    with pytest.raises(RoastBatchIncomplete) as excinfo:
+        roast_code_batch(["x = 1", "y = 2"], mode="serious")
+    full = calculate_actual_cost_cents(1200, 0, 0, 300, FakeAPI.MODEL)
+    assert [r.cost_cents for r in excinfo.value.results] == [pytest.approx(full * 1.5)]
+    assert excinfo.value.unassigned_cents == pytest.approx(full / 2)
+
+
+def test_roast_code_batch_tier_without_limit(fake_api, monkeypatch):
+    fake_api.reply = multi_snippet_reply
+    monkeypatch.setattr(roaster, 'MULTI_SNIPPET_LIMITS', {})
+    results = roast_code_batch(["x = 1"] * 9, mode="serious")
+    assert len(results) == 9
+    assert len(fake_api.calls) == 2
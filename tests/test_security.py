@@ -0,0 +1,58 @@
+"""Tests for roast markdown rendering and sanitization."""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Set up a temp database before importing app modules
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmpdir, "test.db")}'
+
+from app.security import render_roast_markdown, _sanitizer
+
+
+def test_script_and_event_handlers_removed():
+    html = render_roast_markdown('<script>alert(1)</script>\n\nhi <img src=x onerror=alert(1)>')
+    assert 'script' not in html
+    assert 'onerror' not in html
+    assert 'alert' not in html
+
+
+def test_javascript_links_removed():
+    html = render_roast_markdown('[click](javascript:alert(1))')
+    assert 'javascript:' not in html
+    assert 'click' in html
+
+
+def test_sanitizer_drops_disallowed_markup():
+    clean = _sanitizer()('<p title="t" lang="en" onclick="x()">a</p>'
+                         '<img src=x onerror="alert(1)"><a href="javascript:alert(1)">l</a>'
+                         '<script>bad()</script>')
+    assert clean == '<p>a</p>l'
+
+
+def test_allowed_tags_survive():
+    html = '<h2>H</h2><p><strong>b</strong> <em>e</em><br></p><blockquote>q</blockquote><hr>' \
+           '<pre><code class="language-py">x</code></pre><span class="hl">s</span>'
+    clean = _sanitizer()(html)
+    for fragment in ('<h2>H</h2>', '<strong>b</strong>', '<em>e</em>', '<br>', '<blockquote>q</blockquote>',
+                     '<hr>', '<pre><code class="language-py">x</code></pre>', '<span class="hl">s</span>'):
+        assert fragment in clean
+
+
+def test_renders_headings_lists_and_fenced_code():
+    html = render_roast_markdown('# Verdict\n\n- one\n- two\n\n1. first\n\n'
+                                 '```python\nx = 1 < 2\n```\n\n**bold** and *em*')
+    assert '<h1>Verdict</h1>' in html
+    assert '<ul>\n<li>one</li>\n<li>two</li>\n</ul>' in html
+    assert '<ol>\n<li>first</li>\n</ol>' in html
+    assert '<pre><code>x = 1 &lt; 2\n</code></pre>' in html
+    assert '<strong>bold</strong> and <em>em</em>' in html
+
+
+def test_raw_html_blocks_dropped_with_their_text():
+    html = render_roast_markdown('before\n\n<div>blk</div>\n\nafter')
+    assert 'blk' not in html
+    assert '<p>before</p>' in html and '<p>after</p>' in html